@@ -14,6 +14,8 @@ from dataclasses import dataclass
 from pathlib import Path
 import io
 import base64
+import hashlib
+import secrets
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.ext import ContextTypes, ConversationHandler
@@ -27,13 +29,19 @@ from PIL import Image, ImageDraw, ImageFont
 import pandas as pd
 
 from config import config, security
-from database import db, User, Download, Admin, Analytics
+from database import db, Download, Admin, Analytics, DatabaseStats
+from downloaders import downloader
 from keyboards import glass_keyboards
 from utils import (
     performance_tracked, smart_cache, text_processor, 
     file_manager, datetime_manager, formatting_utils, security_manager
 )
 
+# Telegram re-encodes photos to at most 1280px per side, so rendering charts
+# beyond ~100 dpi only adds render time and upload bytes
+CHART_DPI = 100
+CHART_PNG_OPTIONS = {'optimize': True}
+
 # Conversation states
 (BROADCAST_TEXT, BROADCAST_MEDIA, BROADCAST_SCHEDULE, 
  ADD_ADMIN, ADD_CHANNEL, SEARCH_USER, CONFIG_UPDATE) = range(7)
@@ -63,8 +71,9 @@ class SystemMonitor:
             'response_time': 5.0
         }
     
-    async def collect_metrics(self) -> Dict[str, Any]:
-        """Collect system performance metrics"""
+    @staticmethod
+    def _sample_host_metrics() -> Dict[str, Any]:
+        """Sample CPU, memory, disk and network usage (blocks for the CPU interval)"""
         import psutil
         
         # CPU and Memory
@@ -75,11 +84,7 @@ class SystemMonitor:
         # Network stats
         network = psutil.net_io_counters()
         
-        # Bot-specific metrics
-        db_stats = await db.get_system_stats()
-        
-        metrics = {
-            'timestamp': datetime.now(),
+        return {
             'cpu_usage': cpu_percent,
             'memory_usage': memory.percent,
             'memory_available': memory.available,
@@ -87,8 +92,21 @@ class SystemMonitor:
             'disk_free': disk.free,
             'network_sent': network.bytes_sent,
             'network_received': network.bytes_recv,
+        }
+    
+    async def collect_metrics(self) -> Dict[str, Any]:
+        """Collect system performance metrics"""
+        # Sample the host in a worker thread while the DB stats query runs
+        host_metrics, db_stats = await asyncio.gather(
+            asyncio.to_thread(self._sample_host_metrics),
+            db.get_system_stats()
+        )
+        
+        metrics = {
+            'timestamp': datetime.now(),
+            **host_metrics,
             'database_stats': db_stats,
-            'active_downloads': len(getattr(db, 'active_downloads', {})),
+            'active_downloads': len(downloader.active_downloads),
             'cache_size': len(smart_cache.cache),
         }
         
@@ -161,7 +179,8 @@ class AdvancedAnalytics:
             
             # Save chart
             chart_path = config.temp_dir / f"user_growth_{int(datetime.now().timestamp())}.png"
-            plt.savefig(chart_path, dpi=300, bbox_inches='tight', facecolor='#1e1e1e')
+            plt.savefig(chart_path, dpi=CHART_DPI, bbox_inches='tight', facecolor='#1e1e1e',
+                        pil_kwargs=CHART_PNG_OPTIONS)
             plt.close()
             
             return str(chart_path)
@@ -201,7 +220,8 @@ class AdvancedAnalytics:
             
             # Save chart  
             chart_path = config.temp_dir / f"platform_stats_{int(datetime.now().timestamp())}.png"
-            plt.savefig(chart_path, dpi=300, bbox_inches='tight', facecolor='#1e1e1e')
+            plt.savefig(chart_path, dpi=CHART_DPI, bbox_inches='tight', facecolor='#1e1e1e',
+                        pil_kwargs=CHART_PNG_OPTIONS)
             plt.close()
             
             return str(chart_path)
@@ -211,12 +231,18 @@ class AdvancedAnalytics:
             return ""
     
     @staticmethod
-    async def generate_comprehensive_report() -> str:
+    def report_fingerprint(platform_stats: List[Dict[str, Any]]) -> str:
+        """Fingerprint of everything the comprehensive report chart depends on"""
+        key = f"{datetime.now().date()}:{platform_stats!r}"
+        return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    
+    @staticmethod
+    async def generate_comprehensive_report(platform_stats: Optional[List[Dict[str, Any]]] = None) -> str:
         """Generate comprehensive analytics report"""
         try:
             # Collect all statistics
-            system_stats = await db.get_system_stats()
-            platform_stats = await db.get_popular_platforms(days=30)
+            if platform_stats is None:
+                platform_stats = await db.get_popular_platforms(days=30)
             
             # Create multi-panel dashboard
             fig = plt.figure(figsize=(16, 12), facecolor='#1e1e1e')
@@ -285,7 +311,8 @@ class AdvancedAnalytics:
             
             # Save report
             report_path = config.temp_dir / f"comprehensive_report_{int(datetime.now().timestamp())}.png"
-            plt.savefig(report_path, dpi=300, bbox_inches='tight', facecolor='#1e1e1e')
+            plt.savefig(report_path, dpi=CHART_DPI, bbox_inches='tight', facecolor='#1e1e1e',
+                        pil_kwargs=CHART_PNG_OPTIONS)
             plt.close()
             
             return str(report_path)
@@ -303,6 +330,7 @@ class AdminPanelManager:
         self.broadcast_queue = asyncio.Queue()
         self.temp_data = {}
         self.active_broadcasts = {}
+        self._report_photo = None  # (fingerprint, telegram file_id) of last sent report
     
     async def is_admin(self, user_id: int) -> bool:
         """Check if user has admin privileges"""
@@ -336,7 +364,7 @@ class AdminPanelManager:
         
         # Get real-time system metrics
         metrics = await self.system_monitor.collect_metrics()
-        system_stats = await db.get_system_stats()
+        system_stats = metrics['database_stats']
         
         # Format admin panel message
         admin_text = f"""👨‍💻 **پنل مدیریت پیشرفته**
@@ -380,12 +408,19 @@ class AdminPanelManager:
         await query.answer()
         
         try:
-            # Generate comprehensive analytics report
-            report_path = await self.analytics.generate_comprehensive_report()
+            # Reuse the last uploaded report unless its inputs changed
+            platform_stats = await db.get_popular_platforms(days=30)
+            fingerprint = self.analytics.report_fingerprint(platform_stats)
+            cached_photo = None
+            report_path = ""
+            if self._report_photo and self._report_photo[0] == fingerprint:
+                cached_photo = self._report_photo[1]
+            else:
+                report_path = await self.analytics.generate_comprehensive_report(platform_stats)
             
             # Collect detailed metrics
             metrics = await self.system_monitor.collect_metrics()
-            detailed_stats = await self._get_detailed_system_info()
+            detailed_stats = await self._get_detailed_system_info(metrics['database_stats'])
             
             stats_text = f"""📊 **آمار تفصیلی سیستم**
 
@@ -430,15 +465,33 @@ class AdminPanelManager:
                 [InlineKeyboardButton("🔙 بازگشت", callback_data="admin_panel")]
             ]
             
+            if cached_photo:
+                # Unchanged report: resend by file_id, no render or upload
+                try:
+                    await query.message.reply_photo(
+                        photo=cached_photo,
+                        caption=stats_text,
+                        reply_markup=InlineKeyboardMarkup(keyboard),
+                        parse_mode='Markdown'
+                    )
+                    return
+                except BadRequest as e:
+                    # Telegram rejected the stale file_id: forget it and render a fresh report
+                    logger.warning(f"Cached report resend failed, rendering again: {e}")
+                    self._report_photo = None
+                    report_path = await self.analytics.generate_comprehensive_report(platform_stats)
+            
             if report_path and Path(report_path).exists():
                 # Send chart as photo with caption
                 with open(report_path, 'rb') as photo:
-                    await query.message.reply_photo(
+                    sent = await query.message.reply_photo(
                         photo=photo,
                         caption=stats_text,
                         reply_markup=InlineKeyboardMarkup(keyboard),
                         parse_mode='Markdown'
                     )
+                if sent.photo:
+                    self._report_photo = (fingerprint, sent.photo[-1].file_id)
                 # Clean up temp file
                 Path(report_path).unlink(missing_ok=True)
             else:
@@ -458,14 +511,15 @@ class AdminPanelManager:
                 ]])
             )
     
-    async def _get_detailed_system_info(self) -> Dict[str, Any]:
+    async def _get_detailed_system_info(self, system_stats: Optional[DatabaseStats] = None) -> Dict[str, Any]:
         """Get comprehensive system information"""
         try:
             import psutil
             import time
             
-            # Basic database stats
-            system_stats = await db.get_system_stats()
+            # Basic database stats (reuse a snapshot the caller already has)
+            if system_stats is None:
+                system_stats = await db.get_system_stats()
             
             # System performance
             process = psutil.Process()
@@ -710,7 +764,7 @@ class AdminPanelManager:
             return
         
         broadcast_data = self.temp_data.pop(user_id)
-        broadcast_id = f"broadcast_{int(datetime.now().timestamp())}"
+        broadcast_id = f"broadcast_{secrets.token_hex(4)}"
         
         # Initialize broadcast stats
         stats = BroadcastStats()
@@ -793,9 +847,9 @@ class AdminPanelManager:
         stats = self.active_broadcasts[broadcast_id]
         
         try:
-            # Get all active users
-            users = await db.get_active_users(days=30)  # Users active in last 30 days
-            stats.total_users = len(users)
+            # Get all active user IDs (users active in last 30 days)
+            user_ids = await db.get_active_user_ids(days=30)
+            stats.total_users = len(user_ids)
             
             logger.info(f"Starting broadcast to {stats.total_users} users")
             
@@ -806,13 +860,14 @@ class AdminPanelManager:
             
             processed = 0
             
-            for i in range(0, len(users), batch_size):
-                batch_users = users[i:i + batch_size]
+            for i in range(0, len(user_ids), batch_size):
+                batch_user_ids = user_ids[i:i + batch_size]
                 batch_results = await self._send_batch_messages(
-                    batch_users, broadcast_data, context
+                    batch_user_ids, broadcast_data, context
                 )
                 
                 # Update statistics
+                blocked_user_ids = []
                 for result in batch_results:
                     if result['success']:
                         stats.successful_sends += 1
@@ -820,10 +875,18 @@ class AdminPanelManager:
                         stats.failed_sends += 1
                         if result['error_type'] == 'blocked':
                             stats.blocked_users += 1
+                            blocked_user_ids.append(result['user_id'])
                         elif result['error_type'] == 'deleted':
                             stats.deleted_accounts += 1
                 
-                processed += len(batch_users)
+                # Exclude users who blocked the bot from future broadcasts
+                if blocked_user_ids:
+                    try:
+                        await db.mark_users_blocked(blocked_user_ids)
+                    except Exception as e:
+                        logger.warning(f"Failed to mark blocked users: {e}")
+                
+                processed += len(batch_user_ids)
                 progress = (processed / stats.total_users) * 100
                 
                 # Update progress every batch
@@ -852,7 +915,7 @@ class AdminPanelManager:
                         logger.warning(f"Failed to update progress message: {e}")
                 
                 # Wait between batches (except for last batch)
-                if i + batch_size < len(users):
+                if i + batch_size < len(user_ids):
                     await asyncio.sleep(batch_delay)
             
             stats.end_time = datetime.now()
@@ -867,63 +930,59 @@ class AdminPanelManager:
             stats.end_time = datetime.now()
             raise
     
-    async def _send_batch_messages(self, users: List[User], broadcast_data: Dict, 
+    async def _send_batch_messages(self, user_ids: List[int], broadcast_data: Dict, 
                                  context: ContextTypes.DEFAULT_TYPE) -> List[Dict[str, Any]]:
-        """Send messages to a batch of users"""
-        results = []
-        
-        for user in users:
-            try:
-                if broadcast_data['type'] == 'text':
-                    await context.bot.send_message(
-                        chat_id=user.user_id,
-                        text=broadcast_data['content'],
-                        parse_mode='Markdown'
-                    )
-                # Add support for other message types (photo, video, etc.)
-                
-                results.append({
-                    'user_id': user.user_id,
-                    'success': True,
-                    'error_type': None
-                })
-                
-            except Forbidden:
-                # User blocked the bot
-                results.append({
-                    'user_id': user.user_id,
-                    'success': False,
-                    'error_type': 'blocked'
-                })
-                # Mark user as inactive
-                await db.update_user_activity(user.user_id, active=False)
+        """Send messages to a batch of users concurrently"""
+        # A batch is well under Telegram's ~30 msg/s limit, so send it in parallel
+        return await asyncio.gather(*[
+            self._send_single_message(user_id, broadcast_data, context)
+            for user_id in user_ids
+        ])
+    
+    async def _send_single_message(self, user_id: int, broadcast_data: Dict,
+                                 context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Any]:
+        """Send broadcast message to one user"""
+        try:
+            if broadcast_data['type'] == 'text':
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=broadcast_data['content'],
+                    parse_mode='Markdown'
+                )
+            # Add support for other message types (photo, video, etc.)
+            
+            return {
+                'user_id': user_id,
+                'success': True,
+                'error_type': None
+            }
+            
+        except Forbidden:
+            # User blocked the bot; flagged in bulk once the batch completes
+            return {
+                'user_id': user_id,
+                'success': False,
+                'error_type': 'blocked'
+            }
+            
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                error_type = 'deleted'
+            else:
+                error_type = 'bad_request'
+            return {
+                'user_id': user_id,
+                'success': False,
+                'error_type': error_type
+            }
                 
-            except BadRequest as e:
-                if "chat not found" in str(e).lower():
-                    results.append({
-                        'user_id': user.user_id,
-                        'success': False,
-                        'error_type': 'deleted'
-                    })
-                else:
-                    results.append({
-                        'user_id': user.user_id,
-                        'success': False,
-                        'error_type': 'bad_request'
-                    })
-                    
-            except Exception as e:
-                logger.warning(f"Error sending to {user.user_id}: {e}")
-                results.append({
-                    'user_id': user.user_id,
-                    'success': False,
-                    'error_type': 'unknown'
-                })
-            
-            # Small delay between messages
-            await asyncio.sleep(0.05)
-        
-        return results
+        except Exception as e:
+            logger.warning(f"Error sending to {user_id}: {e}")
+            return {
+                'user_id': user_id,
+                'success': False,
+                'error_type': 'unknown'
+            }
     
     async def _save_broadcast_statistics(self, broadcast_data: Dict, stats: BroadcastStats):
         """Save broadcast statistics to database"""
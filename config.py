@@ -61,6 +61,11 @@ class BotSettings(BaseSettings):
     encryption_key: Optional[str] = Field(None, env='ENCRYPTION_KEY')
     webhook_secret: Optional[str] = Field(None, env='WEBHOOK_SECRET')
     
+    # Webhook (push delivery instead of long polling when webhook_url is set)
+    webhook_url: Optional[str] = Field(None, env='WEBHOOK_URL')
+    webhook_listen: str = Field("0.0.0.0", env='WEBHOOK_LISTEN')
+    webhook_port: int = Field(8443, env='WEBHOOK_PORT')
+    
     # Performance
     max_concurrent_downloads: int = Field(10, env='MAX_CONCURRENT_DOWNLOADS')
     request_timeout: int = Field(30, env='REQUEST_TIMEOUT')
@@ -286,6 +291,13 @@ class SecurityConfig:
         'document': ['.pdf', '.doc', '.docx', '.txt']
     }
     
+    # Reverse index: extension -> category
+    EXTENSION_CATEGORIES = {
+        ext: category
+        for category, extensions in ALLOWED_EXTENSIONS.items()
+        for ext in extensions
+    }
+    
     BLOCKED_EXTENSIONS = [
         '.exe', '.bat', '.cmd', '.scr', '.pif', '.vbs', '.js',
         '.jar', '.com', '.app', '.deb', '.rpm'
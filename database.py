@@ -6,9 +6,10 @@
 """
 
 import asyncio
-import json
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Tuple
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 import uuid
 from dataclasses import dataclass
@@ -22,8 +23,9 @@ from sqlalchemy import (
 from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy import select, update, delete, func, and_, or_
+from sqlalchemy import select, update, delete, func, and_, or_, case
 from loguru import logger
+import orjson
 import redis.asyncio as redis
 
 from config import config
@@ -31,6 +33,19 @@ from config import config
 # Database Models
 Base = declarative_base()
 
+# Minimum seconds between two last_activity writes for the same user
+ACTIVITY_UPDATE_INTERVAL = 60
+
+# Seconds a computed system stats snapshot is reused
+SYSTEM_STATS_TTL = 10
+
+# Seconds an admin check result is reused before re-reading the admins table
+ADMIN_CACHE_TTL = 30
+
+def _json_serializer(obj: Any) -> str:
+    """Serialize JSON columns with orjson (also handles datetime values)"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
 @dataclass
 class DatabaseStats:
     """Database statistics container"""
@@ -208,6 +223,9 @@ class DatabaseManager:
         self.session_factory = None
         self.redis_client = None
         self._initialized = False
+        self._activity_touched: Dict[int, int] = OrderedDict()  # oldest stamp first
+        self._admin_cache: Dict[int, Tuple[float, bool]] = OrderedDict()  # (expires_at, is_admin), oldest first
+        self._stats_cache: Optional[Tuple[float, DatabaseStats]] = None
         
     async def initialize(self):
         """Initialize database connections"""
@@ -220,6 +238,8 @@ class DatabaseManager:
                 max_overflow=0,
                 pool_pre_ping=True,
                 pool_recycle=3600,
+                json_serializer=_json_serializer,
+                json_deserializer=orjson.loads,
             )
             
             # Create session factory
@@ -280,6 +300,8 @@ class DatabaseManager:
                     if hasattr(user, key):
                         setattr(user, key, value)
                 user.last_activity = datetime.utcnow()
+                # Reaching us again means the bot is no longer blocked
+                user.is_blocked = False
             else:
                 # Create new user
                 user = User(**user_data)
@@ -297,7 +319,19 @@ class DatabaseManager:
             return result.scalars().first()
     
     async def update_user_activity(self, user_id: int) -> bool:
-        """Update user's last activity"""
+        """Update user's last activity (throttled per user)"""
+        # Skip the write if this user was touched within the last minute
+        now = int(time.time())
+        touched = self._activity_touched
+        if now - touched.get(user_id, 0) < ACTIVITY_UPDATE_INTERVAL:
+            return True
+        touched[user_id] = now
+        touched.move_to_end(user_id)
+        
+        # Forget stamps that no longer throttle anything, keeping the dict bounded
+        while now - next(iter(touched.values())) >= ACTIVITY_UPDATE_INTERVAL:
+            touched.popitem(last=False)
+        
         try:
             async with self.get_session() as session:
                 await session.execute(
@@ -307,25 +341,49 @@ class DatabaseManager:
                 )
                 return True
         except Exception as e:
+            self._activity_touched.pop(user_id, None)
             logger.error(f"Error updating user activity: {e}")
             return False
     
+    @staticmethod
+    def _active_users_query(entity, days: int):
+        """Select entity for reachable users active within specified days"""
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        return (
+            select(entity)
+            .where(
+                and_(
+                    User.last_activity >= cutoff_date,
+                    User.is_blocked == False,
+                    User.is_banned == False
+                )
+            )
+            .order_by(User.last_activity.desc())
+        )
+    
     async def get_active_users(self, days: int = 7) -> List[User]:
         """Get users active within specified days"""
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        async with self.get_session() as session:
+            result = await session.execute(self._active_users_query(User, days))
+            return result.scalars().all()
+    
+    async def get_active_user_ids(self, days: int = 7) -> List[int]:
+        """Get IDs of users active within specified days (no ORM objects)"""
+        async with self.get_session() as session:
+            result = await session.execute(self._active_users_query(User.user_id, days))
+            return result.scalars().all()
+    
+    async def mark_users_blocked(self, user_ids: List[int]) -> int:
+        """Flag users who blocked the bot in a single UPDATE"""
+        if not user_ids:
+            return 0
         async with self.get_session() as session:
             result = await session.execute(
-                select(User)
-                .where(
-                    and_(
-                        User.last_activity >= cutoff_date,
-                        User.is_blocked == False,
-                        User.is_banned == False
-                    )
-                )
-                .order_by(User.last_activity.desc())
+                update(User)
+                .where(User.user_id.in_(user_ids))
+                .values(is_blocked=True)
             )
-            return result.scalars().all()
+            return result.rowcount
     
     # Download Management
     async def save_download(self, download_data: Dict[str, Any]) -> Download:
@@ -390,56 +448,51 @@ class DatabaseManager:
     
     # Analytics and Statistics
     async def get_system_stats(self) -> DatabaseStats:
-        """Get comprehensive system statistics"""
+        """Get comprehensive system statistics (cached for SYSTEM_STATS_TTL)"""
+        now = time.monotonic()
+        if self._stats_cache and now - self._stats_cache[0] < SYSTEM_STATS_TTL:
+            return self._stats_cache[1]
+        
+        stats = await self._query_system_stats()
+        self._stats_cache = (now, stats)
+        return stats
+    
+    async def _query_system_stats(self) -> DatabaseStats:
+        """Compute system statistics from the database"""
         async with self.get_session() as session:
             # Today's date for filtering
             today = datetime.utcnow().date()
             
-            # Total users
-            total_users = await session.scalar(
-                select(func.count(User.user_id))
-                .where(User.is_banned == False)
-            )
-            
-            # Active users today
-            active_today = await session.scalar(
-                select(func.count(User.user_id))
-                .where(
-                    and_(
-                        func.date(User.last_activity) == today,
-                        User.is_blocked == False,
-                        User.is_banned == False
-                    )
+            # User counters in one pass over users
+            user_counts = (await session.execute(
+                select(
+                    func.count(User.user_id).label('total'),
+                    func.sum(case((
+                        and_(
+                            func.date(User.last_activity) == today,
+                            User.is_blocked == False
+                        ), 1), else_=0
+                    )).label('active_today')
                 )
-            )
-            
-            # Total downloads
-            total_downloads = await session.scalar(
-                select(func.count(Download.id))
-                .where(Download.success == True)
-            )
+                .where(User.is_banned == False)
+            )).one()
             
-            # Downloads today
-            downloads_today = await session.scalar(
-                select(func.count(Download.id))
-                .where(
-                    and_(
-                        func.date(Download.download_date) == today,
-                        Download.success == True
-                    )
+            # Download counters and average time in one pass over downloads
+            download_counts = (await session.execute(
+                select(
+                    func.sum(case((Download.success == True, 1), else_=0)).label('successful'),
+                    func.sum(case((Download.success == False, 1), else_=0)).label('failed'),
+                    func.sum(case((
+                        and_(
+                            func.date(Download.download_date) == today,
+                            Download.success == True
+                        ), 1), else_=0
+                    )).label('today'),
+                    # AVG skips the NULLs produced for failed downloads
+                    func.avg(case((Download.success == True, Download.download_time))).label('avg_time')
                 )
-            )
-            
-            # Success/failure rates
-            successful = await session.scalar(
-                select(func.count(Download.id))
-                .where(Download.success == True)
-            ) or 0
-            
-            failed = await session.scalar(
-                select(func.count(Download.id))
-                .where(Download.success == False)
-            ) or 0
+            )).one()
+            successful = download_counts.successful or 0
             
             # Popular platform
             popular_result = await session.execute(
@@ -455,26 +508,15 @@ class DatabaseManager:
             popular_row = popular_result.first()
             popular_platform = popular_row.platform if popular_row else "نامشخص"
             
-            # Average download time
-            avg_time = await session.scalar(
-                select(func.avg(Download.download_time))
-                .where(
-                    and_(
-                        Download.success == True,
-                        Download.download_time.isnot(None)
-                    )
-                )
-            ) or 0.0
-            
             return DatabaseStats(
-                total_users=total_users or 0,
-                active_users_today=active_today or 0,
-                total_downloads=total_downloads or 0,
-                downloads_today=downloads_today or 0,
+                total_users=user_counts.total or 0,
+                active_users_today=user_counts.active_today or 0,
+                total_downloads=successful,
+                downloads_today=download_counts.today or 0,
                 successful_downloads=successful,
-                failed_downloads=failed,
+                failed_downloads=download_counts.failed or 0,
                 popular_platform=popular_platform,
-                avg_download_time=round(avg_time, 2)
+                avg_download_time=round(download_counts.avg_time or 0.0, 2)
             )
     
     async def save_analytics(self, metric_type: str, metric_name: str, 
@@ -496,9 +538,15 @@ class DatabaseManager:
         if user_id in config.admin_ids:
             return True
         
+        # Short-lived cache so admins revoked in the DB lose access promptly
+        now = time.monotonic()
+        cached = self._admin_cache.get(user_id)
+        if cached and now < cached[0]:
+            return cached[1]
+        
         async with self.get_session() as session:
             result = await session.execute(
-                select(Admin)
+                select(Admin.user_id)
                 .where(
                     and_(
                         Admin.user_id == user_id,
@@ -506,7 +554,16 @@ class DatabaseManager:
                     )
                 )
             )
-            return result.scalars().first() is not None
+            is_admin = result.first() is not None
+        
+        cache = self._admin_cache
+        cache[user_id] = (now + ADMIN_CACHE_TTL, is_admin)
+        cache.move_to_end(user_id)
+        
+        # Drop expired entries so non-admins probing admin buttons don't pile up
+        while next(iter(cache.values()))[0] <= now:
+            cache.popitem(last=False)
+        return is_admin
     
     async def add_admin(self, user_id: int, role: str = 'admin', 
                        added_by: int = None) -> bool:
@@ -519,7 +576,8 @@ class DatabaseManager:
                     added_by=added_by
                 )
                 session.add(admin)
-                return True
+            self._admin_cache.clear()
+            return True
         except Exception as e:
             logger.error(f"Error adding admin: {e}")
             return False
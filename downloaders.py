@@ -8,7 +8,6 @@
 import asyncio
 import os
 import re
-import json
 import tempfile
 import shutil
 from datetime import datetime
@@ -16,11 +15,11 @@ from typing import Dict, List, Optional, Union, Any, Tuple
 from dataclasses import dataclass, field
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs
-import hashlib
 
 import yt_dlp
 import aiohttp
 import aiofiles
+import orjson
 from PIL import Image
 import ffmpeg
 from mutagen.mp3 import MP3
@@ -36,6 +35,12 @@ from utils import (
     file_manager, NetworkManager, rate_limiter
 )
 
+# Read size for streaming remote media to disk
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Max pooled keep-alive connections per downloader session
+HTTP_POOL_SIZE = 20
+
 @dataclass
 class MediaMetadata:
     """Enhanced media metadata container"""
@@ -95,6 +100,7 @@ class DownloadResult:
     success: bool = False
     file_path: str = ""
     thumbnail_path: str = ""
+    work_dir: str = ""  # private temp directory holding this download's files
     error_message: str = ""
     error_code: str = ""
     
@@ -162,11 +168,8 @@ class QualitySelector:
             
             return score
         
-        # Sort by score and return best
-        scored = [(score_format(fmt), fmt) for fmt in filtered]
-        scored.sort(key=lambda x: x[0], reverse=True)
-        
-        return scored[0][1] if scored else filtered[0]
+        # Single pass for the best score (first wins on ties, as with a stable sort)
+        return max(filtered, key=score_format)
 
 class PlatformDownloader:
     """Base class for platform-specific downloaders"""
@@ -178,13 +181,32 @@ class PlatformDownloader:
     
     async def __aenter__(self):
         """Async context manager entry"""
-        self.session = aiohttp.ClientSession()
+        self._get_session()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
-        if self.session:
+        await self.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session, creating it on first use"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+                # No total cap, so large files can finish, but a stalled connect or read fails
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=config.request_timeout,
+                    sock_read=config.request_timeout
+                )
+            )
+        return self.session
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self.session and not self.session.closed:
             await self.session.close()
+        self.session = None
     
     @performance_tracked
     async def download(self, url: str, options: Dict[str, Any]) -> DownloadResult:
@@ -194,10 +216,51 @@ class PlatformDownloader:
     async def get_metadata(self, url: str) -> MediaMetadata:
         """Get media metadata without downloading"""
         raise NotImplementedError
+    
+    @staticmethod
+    def _make_work_dir(prefix: str) -> Path:
+        """Create a private temp directory so concurrent downloads never share files"""
+        return Path(tempfile.mkdtemp(prefix=prefix, dir=config.temp_dir))
+    
+    async def _stream_to_file(self, url: str, file_path: Path) -> Optional[str]:
+        """Stream a remote file to disk, enforcing the size limit.
+        
+        Returns None on success or an error code on failure.
+        """
+        max_size = config.max_file_size_mb * 1024 * 1024
+        size = 0
+        
+        async with self._get_session().get(url) as resp:
+            if resp.status != 200:
+                return "NETWORK_ERROR"
+            if (resp.content_length or 0) > max_size:
+                return "FILE_TOO_LARGE"
+            
+            async with aiofiles.open(file_path, 'wb') as f:
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        break
+                    await f.write(chunk)
+        
+        if size > max_size:
+            file_path.unlink(missing_ok=True)
+            return "FILE_TOO_LARGE"
+        return None
 
 class YouTubeDownloader(PlatformDownloader):
     """Advanced YouTube downloader"""
     
+    # Quality name -> yt-dlp format selector
+    QUALITY_FORMATS = {
+        '2160p': 'best[height<=2160]/best',
+        '1080p': 'best[height<=1080]/best',
+        '720p': 'best[height<=720]/best',
+        '480p': 'best[height<=480]/best',
+        'best': 'best[height<=1080]/best',
+        'worst': 'worst/best'
+    }
+    
     def __init__(self):
         super().__init__('youtube')
         self.ytdl_opts = {
@@ -223,8 +286,8 @@ class YouTubeDownloader(PlatformDownloader):
         
         try:
             # Configure output options
-            output_dir = Path(config.temp_dir) / f"yt_{hashlib.md5(url.encode()).hexdigest()[:8]}"
-            await file_manager.ensure_directory(output_dir)
+            output_dir = self._make_work_dir(f"yt_{text_processor.url_digest(url)[:8]}_")
+            result.work_dir = str(output_dir)
             
             opts = self.ytdl_opts.copy()
             opts.update({
@@ -242,10 +305,10 @@ class YouTubeDownloader(PlatformDownloader):
             
             opts['progress_hooks'] = [progress_hook]
             
-            # Download with yt-dlp
+            # Download with yt-dlp (blocking calls run in worker threads)
             with yt_dlp.YoutubeDL(opts) as ydl:
                 # Extract info first
-                info = ydl.extract_info(url, download=False)
+                info = await asyncio.to_thread(ydl.extract_info, url, download=False)
                 
                 # Fill metadata
                 result.metadata = await self._extract_metadata(info)
@@ -257,7 +320,7 @@ class YouTubeDownloader(PlatformDownloader):
                     return result
                 
                 # Download the file
-                ydl.download([url])
+                await asyncio.to_thread(ydl.download, [url])
                 
                 # Find downloaded file
                 downloaded_files = list(output_dir.glob('*'))
@@ -276,9 +339,10 @@ class YouTubeDownloader(PlatformDownloader):
                     result.quality_score = self._calculate_quality_score(info)
                 
         except Exception as e:
-            result.error_message = f"خطا در دانلود از یوتیوب: {str(e)}"
+            error_text = str(e)
+            result.error_message = f"خطا در دانلود از یوتیوب: {error_text}"
             result.error_code = "YOUTUBE_DOWNLOAD_ERROR"
-            logger.error(f"YouTube download error: {e}")
+            logger.error(f"YouTube download error: {error_text}")
         
         result.processing_time = (datetime.now() - start_time).total_seconds()
         return result
@@ -291,16 +355,7 @@ class YouTubeDownloader(PlatformDownloader):
         if format_type == 'audio':
             return 'bestaudio[ext=m4a]/bestaudio'
         
-        quality_map = {
-            '2160p': 'best[height<=2160]',
-            '1080p': 'best[height<=1080]',
-            '720p': 'best[height<=720]',
-            '480p': 'best[height<=480]',
-            'best': 'best[height<=1080]',
-            'worst': 'worst'
-        }
-        
-        return quality_map.get(quality, 'best[height<=1080]') + '/best'
+        return self.QUALITY_FORMATS.get(quality, 'best[height<=1080]/best')
     
     async def _extract_metadata(self, info: Dict[str, Any]) -> MediaMetadata:
         """Extract comprehensive metadata from yt-dlp info"""
@@ -400,14 +455,16 @@ class InstagramDownloader(PlatformDownloader):
                 return result
             
             # Get post data
-            post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
+            post = await asyncio.to_thread(
+                instaloader.Post.from_shortcode, self.loader.context, shortcode
+            )
             
             # Fill metadata
             result.metadata = await self._extract_instagram_metadata(post)
             
             # Download media
-            output_dir = Path(config.temp_dir) / f"ig_{shortcode}"
-            await file_manager.ensure_directory(output_dir)
+            output_dir = self._make_work_dir(f"ig_{shortcode}_")
+            result.work_dir = str(output_dir)
             
             if post.is_video:
                 # Download video
@@ -415,12 +472,11 @@ class InstagramDownloader(PlatformDownloader):
                 filename = f"instagram_{shortcode}.mp4"
                 file_path = output_dir / filename
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(video_url) as resp:
-                        if resp.status == 200:
-                            async with aiofiles.open(file_path, 'wb') as f:
-                                async for chunk in resp.content.iter_chunked(8192):
-                                    await f.write(chunk)
+                error_code = await self._stream_to_file(video_url, file_path)
+                if error_code:
+                    result.error_message = "خطا در دریافت فایل از اینستاگرام"
+                    result.error_code = error_code
+                    return result
                 
                 result.file_path = str(file_path)
                 result.metadata.format = "mp4"
@@ -431,12 +487,11 @@ class InstagramDownloader(PlatformDownloader):
                 filename = f"instagram_{shortcode}.jpg"
                 file_path = output_dir / filename
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(img_url) as resp:
-                        if resp.status == 200:
-                            async with aiofiles.open(file_path, 'wb') as f:
-                                async for chunk in resp.content.iter_chunked(8192):
-                                    await f.write(chunk)
+                error_code = await self._stream_to_file(img_url, file_path)
+                if error_code:
+                    result.error_message = "خطا در دریافت فایل از اینستاگرام"
+                    result.error_code = error_code
+                    return result
                 
                 result.file_path = str(file_path)
                 result.metadata.format = "jpg"
@@ -445,21 +500,17 @@ class InstagramDownloader(PlatformDownloader):
             thumb_url = post.url if not post.is_video else None
             if thumb_url:
                 thumb_path = output_dir / f"thumb_{shortcode}.jpg"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(thumb_url) as resp:
-                        if resp.status == 200:
-                            async with aiofiles.open(thumb_path, 'wb') as f:
-                                async for chunk in resp.content.iter_chunked(8192):
-                                    await f.write(chunk)
-                result.thumbnail_path = str(thumb_path)
+                if not await self._stream_to_file(thumb_url, thumb_path):
+                    result.thumbnail_path = str(thumb_path)
             
             result.success = True
             result.quality_score = 85  # Instagram generally has good quality
             
         except Exception as e:
-            result.error_message = f"خطا در دانلود از اینستاگرام: {str(e)}"
+            error_text = str(e)
+            result.error_message = f"خطا در دانلود از اینستاگرام: {error_text}"
             result.error_code = "INSTAGRAM_DOWNLOAD_ERROR"
-            logger.error(f"Instagram download error: {e}")
+            logger.error(f"Instagram download error: {error_text}")
         
         result.processing_time = (datetime.now() - start_time).total_seconds()
         return result
@@ -546,7 +597,7 @@ class SpotifyDownloader(PlatformDownloader):
                 return result
             
             # Get track info from Spotify
-            track_info = self.spotify_client.track(track_id)
+            track_info = await asyncio.to_thread(self.spotify_client.track, track_id)
             
             # Build search query
             artists = ', '.join([artist['name'] for artist in track_info['artists']])
@@ -578,9 +629,10 @@ class SpotifyDownloader(PlatformDownloader):
                 result.error_code = "SPOTIFY_TRACK_NOT_FOUND"
         
         except Exception as e:
-            result.error_message = f"خطا در دانلود از اسپاتیفای: {str(e)}"
+            error_text = str(e)
+            result.error_message = f"خطا در دانلود از اسپاتیفای: {error_text}"
             result.error_code = "SPOTIFY_DOWNLOAD_ERROR"
-            logger.error(f"Spotify download error: {e}")
+            logger.error(f"Spotify download error: {error_text}")
         
         result.processing_time = (datetime.now() - start_time).total_seconds()
         return result
@@ -637,17 +689,16 @@ class SpotifyDownloader(PlatformDownloader):
             # Add album art
             if album and album.get('images'):
                 img_url = album['images'][0]['url']
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(img_url) as resp:
-                        if resp.status == 200:
-                            img_data = await resp.read()
-                            audio.tags.add(APIC(
-                                encoding=3,
-                                mime='image/jpeg',
-                                type=3,
-                                desc='Cover',
-                                data=img_data
-                            ))
+                async with self._get_session().get(img_url) as resp:
+                    if resp.status == 200:
+                        img_data = await resp.read()
+                        audio.tags.add(APIC(
+                            encoding=3,
+                            mime='image/jpeg',
+                            type=3,
+                            desc='Cover',
+                            data=img_data
+                        ))
             
             audio.save()
             logger.info(f"Added ID3 tags to {file_path}")
@@ -678,7 +729,7 @@ class UniversalDownloaderEngine:
                            options: Dict[str, Any] = None) -> DownloadResult:
         """Main download method with comprehensive error handling"""
         options = options or {}
-        download_id = f"{user_id}_{hashlib.md5(url.encode()).hexdigest()[:8]}"
+        download_id = f"{user_id}_{text_processor.url_digest(url)[:8]}"
         
         # Check rate limiting
         rate_limit_key = f"download:{user_id}"
@@ -709,13 +760,13 @@ class UniversalDownloaderEngine:
             logger.info(f"Starting download from {platform} for user {user_id}: {url}")
             
             # Get platform-specific downloader
-            downloader = self.downloaders.get(platform)
-            if not downloader:
-                # Fallback to yt-dlp for other platforms
-                downloader = YouTubeDownloader()
+            # Fallback to the shared yt-dlp downloader for other platforms
+            downloader = self.downloaders.get(platform) or self.downloaders['youtube']
             
             # Perform download
             result = await downloader.download(url, options)
+            if not result.success and result.work_dir:
+                shutil.rmtree(result.work_dir, ignore_errors=True)
             
             # Update statistics
             self.download_stats['total'] += 1
@@ -732,8 +783,8 @@ class UniversalDownloaderEngine:
             
             # Cache successful results
             if result.success and config.enable_caching:
-                cache_key = f"download_result:{hashlib.md5(url.encode()).hexdigest()}"
-                await smart_cache.set(cache_key, json.dumps({
+                cache_key = f"download_result:{text_processor.url_digest(url)}"
+                await smart_cache.set(cache_key, orjson.dumps({
                     'file_path': result.file_path,
                     'metadata': result.metadata.__dict__,
                     'quality_score': result.quality_score,
@@ -744,9 +795,10 @@ class UniversalDownloaderEngine:
             return result
             
         except Exception as e:
-            logger.error(f"Unexpected error in download_media: {e}")
+            error_text = str(e)
+            logger.error(f"Unexpected error in download_media: {error_text}")
             result = DownloadResult()
-            result.error_message = f"خطای غیرمنتظره: {str(e)}"
+            result.error_message = f"خطای غیرمنتظره: {error_text}"
             result.error_code = "UNEXPECTED_ERROR"
             return result
             
@@ -756,7 +808,7 @@ class UniversalDownloaderEngine:
     async def _detect_platform(self, url: str) -> Optional[str]:
         """Enhanced platform detection"""
         # Check cache first
-        cache_key = f"platform_detect:{hashlib.md5(url.encode()).hexdigest()}"
+        cache_key = f"platform_detect:{text_processor.url_digest(url)}"
         cached = await smart_cache.get(cache_key)
         if cached:
             return cached
@@ -790,6 +842,11 @@ class UniversalDownloaderEngine:
         """Get download statistics"""
         return self.download_stats.copy()
     
+    async def close(self):
+        """Close HTTP sessions held by platform downloaders"""
+        for platform_downloader in self.downloaders.values():
+            await platform_downloader.close()
+    
     async def cleanup_temp_files(self):
         """Clean up temporary download files"""
         try:
@@ -10,8 +10,12 @@ import asyncio
 import sys
 import signal
 import os
+import secrets
+import shutil
 from contextlib import asynccontextmanager
+from itertools import chain, islice
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, Any, Optional
 
 # Third-party imports
@@ -20,7 +24,7 @@ from telegram.ext import (
     Application, ApplicationBuilder, CommandHandler, MessageHandler, 
     CallbackQueryHandler, ConversationHandler, filters, ContextTypes
 )
-from telegram.error import TelegramError, NetworkError, TimedOut
+from telegram.error import TelegramError, NetworkError, TimedOut, BadRequest
 from loguru import logger
 import uvloop  # High-performance event loop
 import sentry_sdk
@@ -66,9 +70,39 @@ if config.sentry_dsn:
         environment="production" if not config.dev_mode else "development"
     )
 
+# Seconds between performance snapshots while active, and the idle backoff cap
+PERFORMANCE_MONITOR_INTERVAL = 300
+PERFORMANCE_MONITOR_MAX_INTERVAL = 3600
+
+# How long a sent file's Telegram file_id is reused for repeat links
+TELEGRAM_FILE_ID_TTL = 86400
+
 class AdvancedMediaBot:
     """Main bot application with enterprise features"""
     
+    # Download error code -> user-facing message
+    DOWNLOAD_ERROR_MESSAGES = {
+        'UNSUPPORTED_PLATFORM': '❌ این پلتفرم پشتیبانی نمی‌شود',
+        'RATE_LIMIT_EXCEEDED': '⏱️ محدودیت سرعت فعال است',
+        'FILE_TOO_LARGE': '📦 فایل بیش از حد مجاز بزرگ است',
+        'INVALID_URL': '🔗 لینک نامعتبر یا منقضی شده',
+        'PRIVATE_CONTENT': '🔒 محتوای خصوصی قابل دانلود نیست',
+        'NETWORK_ERROR': '🌐 مشکل اتصال به اینترنت',
+        'SERVER_ERROR': '🔧 مشکل موقت سرور'
+    }
+    
+    # File extension -> Telegram media kind (anything else is sent as a document)
+    MEDIA_KINDS = {
+        **dict.fromkeys(('.mp4', '.avi', '.mkv', '.mov', '.webm'), 'video'),
+        **dict.fromkeys(('.mp3', '.wav', '.flac', '.m4a', '.aac'), 'audio'),
+        **dict.fromkeys(('.jpg', '.jpeg', '.png', '.gif', '.webp'), 'photo'),
+    }
+    
+    # Extra reply_<kind> arguments per media kind
+    MEDIA_REPLY_OPTIONS = {
+        'video': {'supports_streaming': True},
+    }
+    
     def __init__(self):
         self.app: Optional[Application] = None
         self.startup_time = datetime.now()
@@ -90,6 +124,10 @@ class AdvancedMediaBot:
         self.active_downloads = {}
         self.user_sessions = {}
         
+        # Static responses rendered once instead of per request
+        self._help_text = self._build_help_text()
+        self._help_keyboard = glass_keyboards.help_menu()
+        
         logger.info("🤖 Advanced Media Download Bot initialized")
     
     @asynccontextmanager
@@ -134,6 +172,7 @@ class AdvancedMediaBot:
         
         # Clean up temporary files
         await downloader.cleanup_temp_files()
+        await downloader.close()
         
         # Close database connections
         await db.close()
@@ -145,9 +184,20 @@ class AdvancedMediaBot:
         logger.success("✅ Bot shutdown completed successfully")
     
     async def _performance_monitor_loop(self):
-        """Background performance monitoring"""
+        """Background performance monitoring (backs off while the bot is idle)"""
+        interval = PERFORMANCE_MONITOR_INTERVAL
+        last_processed = None
+        
         while self.is_running and not self.shutdown_requested:
             try:
+                # Nothing new since the last snapshot: skip it and poll less often
+                if self.metrics['messages_processed'] == last_processed:
+                    interval = min(interval * 2, PERFORMANCE_MONITOR_MAX_INTERVAL)
+                    await asyncio.sleep(interval)
+                    continue
+                last_processed = self.metrics['messages_processed']
+                interval = PERFORMANCE_MONITOR_INTERVAL
+                
                 # Collect performance metrics
                 performance_data = {
                     'timestamp': datetime.now(),
@@ -167,8 +217,7 @@ class AdvancedMediaBot:
                         metadata=performance_data
                     )
                 
-                # Wait 5 minutes before next collection
-                await asyncio.sleep(300)
+                await asyncio.sleep(interval)
                 
             except Exception as e:
                 logger.error(f"Error in performance monitoring: {e}")
@@ -205,8 +254,8 @@ class AdvancedMediaBot:
                 'language_code': user.language_code or 'fa'
             }
             
+            # add_or_update_user already stamps last_activity
             db_user = await db.add_or_update_user(user_data)
-            await db.update_user_activity(user_id)
             
             # Check membership requirements
             if not await self._check_user_access(user_id):
@@ -269,7 +318,15 @@ class AdvancedMediaBot:
         """Comprehensive help system"""
         self._track_command('help')
         
-        # Get enabled platforms dynamically
+        await update.message.reply_text(
+            self._help_text,
+            reply_markup=self._help_keyboard,
+            parse_mode='Markdown'
+        )
+    
+    def _build_help_text(self) -> str:
+        """Render the help message (identical for every user)"""
+        # Enabled platforms are read once, at startup
         enabled_platforms = platforms.get_enabled_platforms()
         platforms_text = "\n".join([
             f"{config.emoji} **{config.name}** - {', '.join(config.domains[:2])}"
@@ -293,13 +350,7 @@ class AdvancedMediaBot:
 /settings - تنظیمات
 /help - این راهنما"""
         
-        keyboard = glass_keyboards.help_menu()
-        
-        await update.message.reply_text(
-            help_text,
-            reply_markup=keyboard,
-            parse_mode='Markdown'
-        )
+        return help_text
     
     @performance_tracked
     async def stats_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -434,14 +485,16 @@ class AdvancedMediaBot:
             # Check if URL is supported
             platform = await downloader._detect_platform(url)
             if not platform:
-                supported_domains = []
-                for platform_config in platforms.get_enabled_platforms().values():
-                    supported_domains.extend(platform_config.domains)
+                # Only the first 10 domains are shown, so stop collecting there
+                supported_domains = islice(chain.from_iterable(
+                    platform_config.domains
+                    for platform_config in platforms.get_enabled_platforms().values()
+                ), 10)
                 
                 await update.message.reply_text(
                     f"{messages.MESSAGES_FA['invalid_url']}\n\n"
                     f"**دامنه‌های پشتیبانی شده:**\n" +
-                    "\n".join([f"• `{domain}`" for domain in supported_domains[:10]]),
+                    "\n".join(f"• `{domain}`" for domain in supported_domains),
                     parse_mode='Markdown'
                 )
                 return
@@ -460,7 +513,7 @@ class AdvancedMediaBot:
     async def _process_download_request(self, update: Update, url: str, 
                                       user_id: int, platform: str) -> None:
         """Process download request with advanced features"""
-        download_id = f"{user_id}_{int(datetime.now().timestamp())}"
+        download_id = f"{user_id}_{secrets.token_hex(4)}"
         
         try:
             # Add to active downloads
@@ -471,10 +524,15 @@ class AdvancedMediaBot:
                 'start_time': datetime.now()
             }
             
+            # Link already sent before: reuse Telegram's copy, no download or upload
+            if await self._send_cached_media(update, url, download_id):
+                self.metrics['downloads_completed'] += 1
+                return
+            
             # Get platform info
-            platform_config = platforms.SUPPORTED_PLATFORMS.get(platform, {})
-            platform_name = platform_config.get('name', platform)
-            platform_emoji = platform_config.get('emoji', '📱')
+            platform_config = platforms.SUPPORTED_PLATFORMS.get(platform)
+            platform_name = platform_config.name if platform_config else platform
+            platform_emoji = platform_config.emoji if platform_config else '📱'
             
             # Show processing message
             processing_msg = await update.message.reply_text(
@@ -536,36 +594,11 @@ class AdvancedMediaBot:
             keyboard = glass_keyboards.download_complete(download_id, has_variants=len(result.variants) > 0)
             
             # Send file based on type
+            kind = self.MEDIA_KINDS.get(file_extension, 'document')
             with open(result.file_path, 'rb') as file:
-                if file_extension in ['.mp4', '.avi', '.mkv', '.mov', '.webm']:
-                    await update.message.reply_video(
-                        video=file,
-                        caption=caption,
-                        parse_mode='Markdown',
-                        reply_markup=keyboard,
-                        supports_streaming=True
-                    )
-                elif file_extension in ['.mp3', '.wav', '.flac', '.m4a', '.aac']:
-                    await update.message.reply_audio(
-                        audio=file,
-                        caption=caption,
-                        parse_mode='Markdown',
-                        reply_markup=keyboard
-                    )
-                elif file_extension in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                    await update.message.reply_photo(
-                        photo=file,
-                        caption=caption,
-                        parse_mode='Markdown',
-                        reply_markup=keyboard
-                    )
-                else:
-                    await update.message.reply_document(
-                        document=file,
-                        caption=caption,
-                        parse_mode='Markdown',
-                        reply_markup=keyboard
-                    )
+                sent = await self._reply_with_media(update, kind, file, caption, keyboard)
+            
+            await self._remember_file_id(url, kind, sent, caption, len(result.variants) > 0)
             
             # Delete processing message
             try:
@@ -588,18 +621,69 @@ class AdvancedMediaBot:
                 reply_markup=glass_keyboards.main_menu()
             )
         finally:
-            # Cleanup temporary file
-            try:
-                if os.path.exists(result.file_path):
-                    os.unlink(result.file_path)
-            except:
-                pass
+            # Cleanup temporary files
+            for temp_path in (result.file_path, result.thumbnail_path):
+                if temp_path:
+                    try:
+                        Path(temp_path).unlink(missing_ok=True)
+                    except OSError:
+                        pass
+            if result.work_dir:
+                shutil.rmtree(result.work_dir, ignore_errors=True)
+    
+    async def _reply_with_media(self, update: Update, kind: str, media, caption: str, keyboard):
+        """Reply with a file object or file_id using the method for its kind"""
+        reply = getattr(update.message, f"reply_{kind}")
+        return await reply(
+            caption=caption,
+            parse_mode='Markdown',
+            reply_markup=keyboard,
+            **{kind: media},
+            **self.MEDIA_REPLY_OPTIONS.get(kind, {})
+        )
+    
+    async def _remember_file_id(self, url: str, kind: str, sent, caption: str, has_variants: bool):
+        """Cache the file_id Telegram assigned to an uploaded file"""
+        attachment = getattr(sent, kind, None)
+        if kind == 'photo' and attachment:
+            attachment = attachment[-1]  # largest size
+        if not attachment:
+            return
+        
+        await smart_cache.set(f"tg_file:{text_processor.url_digest(url)}", {
+            'kind': kind,
+            'file_id': attachment.file_id,
+            'caption': caption,
+            'has_variants': has_variants,
+        }, ttl=TELEGRAM_FILE_ID_TTL)
+    
+    async def _send_cached_media(self, update: Update, url: str, download_id: str) -> bool:
+        """Resend a previously uploaded file by file_id; False on cache miss"""
+        cache_key = f"tg_file:{text_processor.url_digest(url)}"
+        cached = await smart_cache.get(cache_key)
+        if not cached:
+            return False
+        
+        keyboard = glass_keyboards.download_complete(download_id, has_variants=cached['has_variants'])
+        try:
+            await self._reply_with_media(
+                update, cached['kind'], cached['file_id'], cached['caption'], keyboard
+            )
+        except TelegramError as e:
+            # Fall back to a fresh download; a rejected file_id is stale, so drop it
+            logger.warning(f"Cached file_id resend failed, downloading again: {e}")
+            if isinstance(e, BadRequest):
+                await smart_cache.delete(cache_key)
+            return False
+        
+        logger.info(f"Resent cached file for user {update.effective_user.id}")
+        return True
     
     async def _create_rich_caption(self, metadata: MediaMetadata, result) -> str:
         """Create rich, informative caption for media"""
-        platform_config = platforms.SUPPORTED_PLATFORMS.get(metadata.platform, {})
-        platform_name = platform_config.get('name', metadata.platform)
-        platform_emoji = platform_config.get('emoji', '📱')
+        platform_config = platforms.SUPPORTED_PLATFORMS.get(metadata.platform)
+        platform_name = platform_config.name if platform_config else metadata.platform
+        platform_emoji = platform_config.emoji if platform_config else '📱'
         
         # Main title and source
         caption_parts = [
@@ -669,17 +753,7 @@ class AdvancedMediaBot:
                                     processing_msg, url: str, user_id: int):
         """Handle failed download with detailed error info"""
         # Create user-friendly error message
-        error_messages = {
-            'UNSUPPORTED_PLATFORM': '❌ این پلتفرم پشتیبانی نمی‌شود',
-            'RATE_LIMIT_EXCEEDED': '⏱️ محدودیت سرعت فعال است',
-            'FILE_TOO_LARGE': '📦 فایل بیش از حد مجاز بزرگ است',
-            'INVALID_URL': '🔗 لینک نامعتبر یا منقضی شده',
-            'PRIVATE_CONTENT': '🔒 محتوای خصوصی قابل دانلود نیست',
-            'NETWORK_ERROR': '🌐 مشکل اتصال به اینترنت',
-            'SERVER_ERROR': '🔧 مشکل موقت سرور'
-        }
-        
-        user_error = error_messages.get(
+        user_error = self.DOWNLOAD_ERROR_MESSAGES.get(
             result.error_code, 
             '❌ خطای نامشخص در دانلود'
         )
@@ -768,6 +842,10 @@ class AdvancedMediaBot:
                 )
                 
         except Exception as e:
+            # Re-pressing a button re-renders identical content; Telegram
+            # rejects the no-op edit and there is nothing to repair
+            if isinstance(e, BadRequest) and "message is not modified" in str(e).lower():
+                return
             logger.error(f"Error in callback query handler: {e}")
             try:
                 await query.edit_message_text(
@@ -1098,16 +1176,30 @@ class AdvancedMediaBot:
             application = self.setup_application()
             self.app = application
             
-            # Start the bot
-            logger.info("🚀 Starting bot polling...")
+            allowed_updates = ['message', 'callback_query', 'my_chat_member']
             
             try:
-                # Run the bot with polling
-                await application.run_polling(
-                    allowed_updates=['message', 'callback_query', 'my_chat_member'],
-                    drop_pending_updates=True,
-                    close_loop=False
-                )
+                if config.webhook_url:
+                    # Telegram pushes updates to us; no idle getUpdates round-trips
+                    logger.info("🚀 Starting bot webhook...")
+                    await application.run_webhook(
+                        listen=config.webhook_listen,
+                        port=config.webhook_port,
+                        url_path=config.bot_token,
+                        webhook_url=f"{config.webhook_url.rstrip('/')}/{config.bot_token}",
+                        secret_token=config.webhook_secret,
+                        allowed_updates=allowed_updates,
+                        drop_pending_updates=True,
+                        close_loop=False
+                    )
+                else:
+                    # Run the bot with polling
+                    logger.info("🚀 Starting bot polling...")
+                    await application.run_polling(
+                        allowed_updates=allowed_updates,
+                        drop_pending_updates=True,
+                        close_loop=False
+                    )
             except KeyboardInterrupt:
                 logger.info("⌨️ Received keyboard interrupt")
             except Exception as e:
@@ -12,21 +12,22 @@ import asyncio
 import hashlib
 import hmac
 import secrets
-from datetime import datetime, timedelta
+import shutil
+import fnmatch
+from datetime import datetime
 from typing import List, Dict, Any, Optional, Union, Tuple, Callable
 from urllib.parse import urlparse, unquote, quote
 import mimetypes
 from pathlib import Path
 import unicodedata
-import aiofiles
 import aiohttp
 from cryptography.fernet import Fernet
 from loguru import logger
 import humanize
 import jdatetime
-from functools import wraps
+from functools import wraps, lru_cache
 import time
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 import asyncio
 import weakref
 
@@ -37,26 +38,30 @@ class PerformanceMonitor:
     
     def __init__(self, max_history: int = 1000):
         self.call_times = defaultdict(deque)
+        self.call_totals = defaultdict(float)  # running sum of call_times
         self.max_history = max_history
     
     def record_call(self, func_name: str, duration: float):
         """Record function call time"""
-        self.call_times[func_name].append(duration)
-        if len(self.call_times[func_name]) > self.max_history:
-            self.call_times[func_name].popleft()
+        times = self.call_times[func_name]
+        times.append(duration)
+        self.call_totals[func_name] += duration
+        if len(times) > self.max_history:
+            self.call_totals[func_name] -= times.popleft()
     
     def get_stats(self, func_name: str) -> Dict[str, float]:
         """Get performance statistics for function"""
-        times = list(self.call_times[func_name])
+        times = self.call_times.get(func_name)
         if not times:
             return {}
         
+        total = self.call_totals[func_name]
         return {
             'count': len(times),
-            'avg': sum(times) / len(times),
+            'avg': total / len(times),
             'min': min(times),
             'max': max(times),
-            'total': sum(times)
+            'total': total
         }
 
 # Global performance monitor
@@ -111,10 +116,12 @@ class RateLimiter:
     def _sliding_window(self, key: str, now: float) -> bool:
         """Sliding window rate limiting"""
         calls = self.calls[key]
+        cutoff = now - self.time_window
+        popleft = calls.popleft
         
         # Remove old calls
-        while calls and calls[0] <= now - self.time_window:
-            calls.popleft()
+        while calls and calls[0] <= cutoff:
+            popleft()
         
         if len(calls) < self.max_calls:
             calls.append(now)
@@ -160,8 +167,7 @@ class SmartCache:
     def __init__(self, max_size: int = 1000, default_ttl: int = 3600):
         self.max_size = max_size
         self.default_ttl = default_ttl
-        self.cache = {}
-        self.access_times = {}
+        self.cache = OrderedDict()  # ordered from least to most recently used
         self.ttls = {}
         self._lock = asyncio.Lock()
     
@@ -174,43 +180,44 @@ class SmartCache:
                     await self._remove(key)
                     return None
                 
-                # Update access time
-                self.access_times[key] = time.time()
+                # Mark as most recently used
+                self.cache.move_to_end(key)
                 return self.cache[key]
             return None
     
     async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Set value in cache"""
         async with self._lock:
-            now = time.time()
-            
             # Check if we need to evict
             if len(self.cache) >= self.max_size and key not in self.cache:
                 await self._evict_lru()
             
             self.cache[key] = value
-            self.access_times[key] = now
-            self.ttls[key] = now + (ttl or self.default_ttl)
+            self.cache.move_to_end(key)
+            self.ttls[key] = time.time() + (ttl or self.default_ttl)
+    
+    async def delete(self, key: str) -> None:
+        """Remove a key from cache"""
+        async with self._lock:
+            await self._remove(key)
     
     async def _evict_lru(self):
         """Evict least recently used item"""
-        if not self.access_times:
+        if not self.cache:
             return
         
-        lru_key = min(self.access_times.keys(), key=lambda k: self.access_times[k])
-        await self._remove(lru_key)
+        lru_key, _ = self.cache.popitem(last=False)
+        self.ttls.pop(lru_key, None)
     
     async def _remove(self, key: str):
         """Remove item from cache"""
         self.cache.pop(key, None)
-        self.access_times.pop(key, None)
         self.ttls.pop(key, None)
     
     async def clear(self):
         """Clear all cache"""
         async with self._lock:
             self.cache.clear()
-            self.access_times.clear()
             self.ttls.clear()
 
 class TextProcessor:
@@ -220,19 +227,30 @@ class TextProcessor:
     ENGLISH_DIGITS = '0123456789'
     ARABIC_DIGITS = '٠١٢٣٤٥٦٧٨٩'
     
+    # Translation tables built once at import, applied in a single pass
+    TO_PERSIAN_DIGITS = str.maketrans(ENGLISH_DIGITS, PERSIAN_DIGITS)
+    ALL_TO_PERSIAN_DIGITS = str.maketrans(ARABIC_DIGITS + ENGLISH_DIGITS, PERSIAN_DIGITS * 2)
+    MARKDOWN_V2_ESCAPES = str.maketrans({
+        char: f'\\{char}' for char in '_*[]()~`>#+-=|{}.!'
+    })
+    
+    # Precompiled patterns shared by every call
+    URL_PATTERN = re.compile(
+        r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+|'
+        r'(?:(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}(?:/[^\s]*)?)',
+        re.IGNORECASE
+    )
+    UNSAFE_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+    CONTROL_CHARS = re.compile(r'[\x00-\x1f]')
+    
     @staticmethod
     def normalize_persian(text: str) -> str:
         """Normalize Persian text"""
         if not text:
             return ""
         
-        # Convert Arabic digits to Persian
-        for i, arabic in enumerate(TextProcessor.ARABIC_DIGITS):
-            text = text.replace(arabic, TextProcessor.PERSIAN_DIGITS[i])
-        
-        # Convert English digits to Persian
-        for i, english in enumerate(TextProcessor.ENGLISH_DIGITS):
-            text = text.replace(english, TextProcessor.PERSIAN_DIGITS[i])
+        # Convert Arabic and English digits to Persian
+        text = text.translate(TextProcessor.ALL_TO_PERSIAN_DIGITS)
         
         # Fix spacing
         text = re.sub(r'\s+', ' ', text.strip())
@@ -245,13 +263,7 @@ class TextProcessor:
     @staticmethod
     def extract_urls(text: str) -> List[str]:
         """Extract URLs from text using advanced regex"""
-        url_pattern = re.compile(
-            r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+|'
-            r'(?:(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}(?:/[^\s]*)?)',
-            re.IGNORECASE
-        )
-        
-        urls = url_pattern.findall(text)
+        urls = TextProcessor.URL_PATTERN.findall(text)
         
         # Add protocol if missing
         normalized_urls = []
@@ -267,10 +279,10 @@ class TextProcessor:
     def clean_filename(filename: str, max_length: int = 100) -> str:
         """Clean filename for safe filesystem use"""
         # Remove dangerous characters
-        cleaned = re.sub(r'[<>:"/\\|?*]', '_', filename)
+        cleaned = TextProcessor.UNSAFE_FILENAME_CHARS.sub('_', filename)
         
         # Remove control characters
-        cleaned = ''.join(char for char in cleaned if ord(char) >= 32)
+        cleaned = TextProcessor.CONTROL_CHARS.sub('', cleaned)
         
         # Normalize spaces
         cleaned = ' '.join(cleaned.split())
@@ -283,6 +295,12 @@ class TextProcessor:
         
         return cleaned.strip() or f"file_{secrets.token_hex(4)}"
     
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def url_digest(url: str) -> str:
+        """Stable short digest of a URL for cache keys and temp names"""
+        return hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+    
     @staticmethod
     def truncate_smart(text: str, max_length: int = 100, 
                       suffix: str = "...") -> str:
@@ -302,10 +320,7 @@ class TextProcessor:
     @staticmethod
     def escape_markdown_v2(text: str) -> str:
         """Escape text for Telegram MarkdownV2"""
-        special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-        for char in special_chars:
-            text = text.replace(char, f'\\{char}')
-        return text
+        return text.translate(TextProcessor.MARKDOWN_V2_ESCAPES)
     
     @staticmethod
     def create_progress_bar(current: int, total: int, length: int = 20, 
@@ -323,6 +338,9 @@ class TextProcessor:
 class FileManager:
     """Advanced file management utilities"""
     
+    # Binary size units for bytes_to_human, one per power of 1024
+    SIZE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+    
     @staticmethod
     async def ensure_directory(path: Union[str, Path]) -> bool:
         """Ensure directory exists asynchronously"""
@@ -340,11 +358,16 @@ class FileManager:
         """Get comprehensive file information"""
         path = Path(file_path)
         
-        if not path.exists():
+        try:
+            # A single stat() doubles as the existence check
+            stat = path.stat()
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            logger.error(f"Error getting file info for {path}: {e}")
             return {}
         
         try:
-            stat = path.stat()
             mime_type, _ = mimetypes.guess_type(str(path))
             
             return {
@@ -368,25 +391,21 @@ class FileManager:
         if size_bytes == 0:
             return "0 B"
         
-        size_names = ["B", "KB", "MB", "GB", "TB", "PB"]
-        i = 0
+        # 1024 == 2**10, so the unit index is the bit length in steps of ten
+        units = FileManager.SIZE_UNITS
+        i = min(max(int(size_bytes).bit_length() - 1, 0) // 10, len(units) - 1)
         
-        while size_bytes >= 1024 and i < len(size_names) - 1:
-            size_bytes /= 1024.0
-            i += 1
-        
-        return f"{size_bytes:.{decimal_places}f} {size_names[i]}"
+        return f"{size_bytes / (1 << (10 * i)):.{decimal_places}f} {units[i]}"
+    
+    @staticmethod
+    def get_file_category(file_path: Union[str, Path]) -> Optional[str]:
+        """Get file category (video, audio, image, document) by extension"""
+        return security.EXTENSION_CATEGORIES.get(Path(file_path).suffix.lower())
     
     @staticmethod
     def is_media_file(file_path: Union[str, Path]) -> bool:
         """Check if file is a media file"""
-        ext = Path(file_path).suffix.lower()
-        
-        all_media_extensions = []
-        for category in security.ALLOWED_EXTENSIONS.values():
-            all_media_extensions.extend(category)
-        
-        return ext in all_media_extensions
+        return FileManager.get_file_category(file_path) is not None
     
     @staticmethod
     async def safe_copy(src: Union[str, Path], dst: Union[str, Path]) -> bool:
@@ -398,11 +417,8 @@ class FileManager:
             # Ensure destination directory exists
             await FileManager.ensure_directory(dst_path.parent)
             
-            # Copy file
-            async with aiofiles.open(src_path, 'rb') as src_file:
-                async with aiofiles.open(dst_path, 'wb') as dst_file:
-                    while chunk := await src_file.read(8192):
-                        await dst_file.write(chunk)
+            # Copy file (shutil uses sendfile(2) on Linux, so bytes stay in the kernel)
+            await asyncio.to_thread(shutil.copyfile, src_path, dst_path)
             
             return True
         except Exception as e:
@@ -416,26 +432,40 @@ class FileManager:
                                pattern: str = "*") -> int:
         """Clean up old files asynchronously"""
         try:
-            path = Path(directory)
-            if not path.exists():
+            cutoff = time.time() - max_age_hours * 3600
+            try:
+                cleaned_count = await asyncio.to_thread(
+                    FileManager._remove_files_older_than, directory, cutoff, pattern
+                )
+            except FileNotFoundError:
+                # Directory itself is missing; vanished entries are skipped inside the scan
                 return 0
             
-            cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
-            cleaned_count = 0
-            
-            for file_path in path.glob(pattern):
-                if file_path.is_file():
-                    file_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-                    if file_time < cutoff_time:
-                        file_path.unlink()
-                        cleaned_count += 1
-            
             logger.info(f"🧹 Cleaned {cleaned_count} old files from {directory}")
             return cleaned_count
             
         except Exception as e:
             logger.error(f"Error cleaning files: {e}")
             return 0
+    
+    @staticmethod
+    def _remove_files_older_than(directory: Union[str, Path], cutoff: float, pattern: str) -> int:
+        """Delete matching files with mtime before cutoff (blocking)"""
+        cleaned_count = 0
+        # scandir reports the entry type from the directory listing, so only
+        # matching regular files cost a stat() call
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not fnmatch.fnmatch(entry.name, pattern) or not entry.is_file():
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        cleaned_count += 1
+                except FileNotFoundError:
+                    # Removed concurrently (e.g. by its own download's cleanup)
+                    continue
+        return cleaned_count
 
 class SecurityManager:
     """Advanced security utilities"""
@@ -636,10 +666,7 @@ class FormattingUtils:
             formatted = str(number)
         
         # Convert to Persian digits
-        for i, digit in enumerate(TextProcessor.ENGLISH_DIGITS):
-            formatted = formatted.replace(digit, TextProcessor.PERSIAN_DIGITS[i])
-        
-        return formatted
+        return formatted.translate(TextProcessor.TO_PERSIAN_DIGITS)
     
     @staticmethod
     def create_info_card(title: str, data: Dict[str, Any], 
@@ -661,34 +688,31 @@ class FormattingUtils:
         if not rows:
             return "جدول خالی"
         
+        # Stringify each cell once, padding short rows
+        str_rows = [
+            [str(row[i]) if i < len(row) else "" for i in range(len(headers))]
+            for row in rows
+        ]
+        
         # Calculate column widths
-        col_widths = []
-        for i, header in enumerate(headers):
-            max_width_col = len(header)
-            for row in rows:
-                if i < len(row):
-                    max_width_col = max(max_width_col, len(str(row[i])))
-            col_widths.append(min(max_width_col, max_width))
+        col_widths = [
+            min(max(len(header), *(len(row[i]) for row in str_rows)), max_width)
+            for i, header in enumerate(headers)
+        ]
+        
+        def format_line(cells: List[str]) -> str:
+            return "|" + "|".join(f" {cell:<{width}} " for cell, width in zip(cells, col_widths)) + "|"
         
         # Create table
         separator = "+" + "+".join("-" * (w + 2) for w in col_widths) + "+"
-        table_lines = [separator]
-        
-        # Header
-        header_line = "|"
-        for i, header in enumerate(headers):
-            header_line += f" {header:<{col_widths[i]}} |"
-        table_lines.extend([header_line, separator])
+        table_lines = [separator, format_line(headers), separator]
         
         # Rows
-        for row in rows:
-            row_line = "|"
-            for i in range(len(headers)):
-                value = str(row[i]) if i < len(row) else ""
-                if len(value) > col_widths[i]:
-                    value = value[:col_widths[i]-3] + "..."
-                row_line += f" {value:<{col_widths[i]}} |"
-            table_lines.append(row_line)
+        for row in str_rows:
+            table_lines.append(format_line([
+                value[:width - 3] + "..." if len(value) > width else value
+                for value, width in zip(row, col_widths)
+            ]))
         
         table_lines.append(separator)
         return "\n".join(table_lines)